@@ -1,17 +1,181 @@
+import hashlib
+import os
 import re
+import sqlite3
+import threading
+import time
 import uuid
 from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta, timezone
+from email.utils import parsedate_to_datetime
+from functools import cached_property, lru_cache
+from typing import Callable, Iterable, Mapping, Optional, TypeVar
+from xml.etree import ElementTree
 
 import feedparser
 import requests
-from deepl import Translator, exceptions
+from deepl import Translator, exceptions, http_client
 from feedparser.util import FeedParserDict
+from requests.adapters import HTTPAdapter
+from urllib3.util import Retry
 
 import slackbot_settings
 
+T = TypeVar("T")
+
+# Patterns used for every article, compiled once at import
+_ARXIV_TITLE_RE = re.compile(r" .(arXiv:.*)")
+_MDPI_TITLE_RE = re.compile(r".*[0-9]: ")
+_AUTHOR_LINK_RE = re.compile(r"<a [^>]*>|</a>")
+_WHITESPACE_RE = re.compile(r"\s+")
+
+# Namespaces of the RSS extensions read by the ElementTree feed parser
+_RSS_NAMESPACES = {"dc": "http://purl.org/dc/elements/1.1/"}
+
+# Retry connection errors and transient server responses with exponential backoff, but not other 4xx
+_RETRY = Retry(
+    total=3,
+    backoff_factor=1,
+    backoff_jitter=1,
+    status_forcelist=[429, 500, 502, 503, 504],
+    allowed_methods=None,
+    raise_on_status=False,
+)
+
+# Shared HTTP clients so that connections are reused across articles and workers
+_SESSION = requests.Session()
+_SESSION.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=16, max_retries=_RETRY))
+
+# The DeepL client takes its retry count and per-attempt connect+read timeout from module settings
+http_client.min_connection_timeout = slackbot_settings.HTTP_TIMEOUT[1]
+http_client.max_network_retries = _RETRY.total
+
+
+# The DeepL client is built on first use so that importing this module needs no token
+@lru_cache(maxsize=1)
+def _get_deepl() -> Translator:
+    return Translator(slackbot_settings.DEEPL_API_TOKEN)
+
+
+class RateLimiter:
+    # Token bucket shared by the worker threads to stay within the translator quotas
+    def __init__(self, rate: float) -> None:
+        if rate <= 0:
+            raise ValueError(f"rate must be positive, got {rate}")
+        self.rate = rate
+        # Hold at least one token so that rates below one request per second can still be acquired
+        self.capacity = max(rate, 1)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self) -> None:
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+class CircuitOpenError(Exception):
+    pass
+
+
+class CircuitBreaker:
+    # Skip a failing translator for a while instead of waiting on it for every article
+    def __init__(self, fail_max: int, reset_timeout: float) -> None:
+        self.fail_max = fail_max
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened = 0.0
+        self.probing = False
+        self.lock = threading.Lock()
+
+    def call(self, func: Callable[..., T], *args, **kwargs) -> T:
+        with self.lock:
+            if self.failures >= self.fail_max:
+                # Once the timeout has passed, let a single caller probe the translator while the rest keep skipping
+                if self.probing or time.monotonic() - self.opened < self.reset_timeout:
+                    raise CircuitOpenError(f"{func.__name__} is disabled after {self.failures} failures")
+                self.probing = True
+        try:
+            result = func(*args, **kwargs)
+        except Exception:
+            with self.lock:
+                self.probing = False
+                self.failures += 1
+                if self.failures >= self.fail_max:
+                    self.opened = time.monotonic()
+            raise
+        with self.lock:
+            self.probing = False
+            self.failures = 0
+        return result
+
+
+class TranslationCache:
+    # Kept in memory for the run and in SQLite so that later runs skip descriptions translated before
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.memory: dict[str, str] = {}
+
+    @cached_property
+    def db(self) -> sqlite3.Connection:
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        db = sqlite3.connect(self.path)
+        db.execute("CREATE TABLE IF NOT EXISTS translation (key TEXT PRIMARY KEY, text TEXT NOT NULL)")
+        return db
+
+    def __contains__(self, key: str) -> bool:
+        return self.get(key) is not None
+
+    def get(self, key: str, default: Optional[str] = None) -> Optional[str]:
+        if key not in self.memory:
+            row = self.db.execute("SELECT text FROM translation WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return default
+            self.memory[key] = row[0]
+        return self.memory[key]
+
+    def update(self, items: Iterable[tuple[str, str]]) -> None:
+        items = dict(items)
+        self.memory.update(items)
+        with self.db:
+            self.db.executemany("INSERT OR REPLACE INTO translation VALUES (?, ?)", items.items())
+
+
+_LIMITER = RateLimiter(slackbot_settings.TRANSLATE_RATE_LIMIT)
+_DEEPL_BREAKER = CircuitBreaker(slackbot_settings.BREAKER_FAIL_MAX, slackbot_settings.BREAKER_RESET_TIMEOUT)
+_MS_BREAKER = CircuitBreaker(slackbot_settings.BREAKER_FAIL_MAX, slackbot_settings.BREAKER_RESET_TIMEOUT)
+
+# Microsoft Translator accepts up to this many characters per request
+_MS_MAX_CHARACTERS = 50000
+
+# Translation results keyed by the SHA-256 of the English description
+_TRANSLATIONS = TranslationCache(slackbot_settings.TRANSLATION_CACHE)
+
 
 class Publisher(ABC):
+    def fetch(self) -> None:
+        try:
+            response = _SESSION.get(self.url, timeout=slackbot_settings.HTTP_TIMEOUT)
+        except requests.RequestException:
+            # Treat an unreachable feed as empty, as feedparser does when it fetches the URL itself
+            self.rss = feedparser.parse(b"")
+        else:
+            # feedparser looks up response headers by lowercase name
+            headers = {key.lower(): value for key, value in response.headers.items()}
+            self.rss = self.parse_feed(response.content, headers)
+
+    def parse_feed(self, content: bytes, headers: Mapping[str, str]) -> FeedParserDict:
+        return feedparser.parse(content, response_headers=headers)
+
     @abstractmethod
     def get_publish_date(self, article: FeedParserDict) -> datetime:
         pass
@@ -21,99 +185,195 @@ class Publisher(ABC):
     def parse_title(title: str) -> str:
         pass
 
+    @staticmethod
     @abstractmethod
-    def format_article(self, article: FeedParserDict, color: str) -> dict[str, str]:
+    def parse_description(article: FeedParserDict) -> str:
+        pass
+
+    @abstractmethod
+    def format_article(
+        self, article: FeedParserDict, title: str, color: str, fields: list[dict]
+    ) -> dict[str, str]:
         pass
 
     def get_articles(self, patterns: list[re.Pattern]) -> dict[str, str]:
-        count = 0
+        today = datetime.now(timezone.utc).date()
+        matched = []
         for article in self.rss.entries:
-            updated_date = self.get_publish_date(article)
-            if updated_date < datetime.now(timezone.utc).date():
-                yield None
-            else:
-                title = self.parse_title(article.title)
-                if bool([p.search(title) for p in patterns if p.search(title) is not None]):
-                    count += 1
-                    yield self.format_article(article, slackbot_settings.COLOR[(count - 1) % 7])
+            if self.get_publish_date(article) < today:
+                continue
+            title = self.parse_title(article.title)
+            if any(p.search(title) for p in patterns):
+                matched.append((article, title))
+
+        colors = slackbot_settings.COLOR
+        descriptions = [self.parse_description(article) for article, _ in matched]
+        for count, ((article, title), fields) in enumerate(zip(matched, self.translate(descriptions))):
+            yield self.format_article(article, title, colors[count % len(colors)], fields)
+
+    @staticmethod
+    def translate(descriptions: list[str]) -> list[list[dict]]:
+        keys = [hashlib.sha256(description.encode()).hexdigest() for description in descriptions]
+        # Blank descriptions are posted as they are, and repeated ones are translated once
+        missing = {
+            key: description
+            for key, description in zip(keys, descriptions)
+            if description.strip() and key not in _TRANSLATIONS
+        }
+        if missing:
+            items = list(missing.items())
+            size = slackbot_settings.TRANSLATE_BATCH_SIZE
+            batches = [items[i : i + size] for i in range(0, len(items), size)]
+
+            # Translation is network-bound, so send the batches concurrently
+            with ThreadPoolExecutor(max_workers=slackbot_settings.MAX_WORKERS) as executor:
+                futures = [executor.submit(Publisher.translate_text, [d for _, d in batch]) for batch in batches]
+                for batch, future in zip(batches, futures):
+                    # Leave failures uncached so that the next call retries
+                    if future.exception() is None:
+                        _TRANSLATIONS.update((key, text) for (key, _), text in zip(batch, future.result()))
+
+        return [
+            [
+                dict(title="English", value=description, short=True),
+                dict(title="Japanese", value=_TRANSLATIONS.get(key, description), short=True),
+            ]
+            for key, description in zip(keys, descriptions)
+        ]
 
     @staticmethod
-    def translate(description: str) -> list[dict]:
+    def translate_text(descriptions: list[str]) -> list[str]:
         try:
-            # DeepL Translator
-            translator = Translator(slackbot_settings.DEEPL_API_TOKEN)
-            translate_description = translator.translate_text(description, source_lang="EN", target_lang="JA").text
-        except exceptions.DeepLException:
-            # Microsoft Translator
-            url = "https://api.cognitive.microsofttranslator.com/translate?api-version=3.0&from=en&to=ja"
+            return _DEEPL_BREAKER.call(Publisher.deepl_translator, descriptions)
+        except (exceptions.DeepLException, CircuitOpenError):
+            return _MS_BREAKER.call(Publisher.microsoft_translator, descriptions)
+
+    @staticmethod
+    def deepl_translator(descriptions: list[str]) -> list[str]:
+        if not slackbot_settings.DEEPL_API_TOKEN:
+            raise exceptions.AuthorizationException("DEEPL_API_TOKEN is not set")
+        _LIMITER.acquire()
+        results = _get_deepl().translate_text(descriptions, source_lang="EN", target_lang="JA")
+        return [result.text for result in results]
+
+    @staticmethod
+    def microsoft_translator(descriptions: list[str]) -> list[str]:
+        url = "https://api.cognitive.microsofttranslator.com/translate?api-version=3.0&from=en&to=ja"
+        translations = []
+        for chunk in Publisher.split_by_length(descriptions, _MS_MAX_CHARACTERS):
             headers = {
                 "Ocp-Apim-Subscription-Key": slackbot_settings.MS_TRANSLATE_KEY,
                 "Ocp-Apim-Subscription-Region": slackbot_settings.MS_TRANSLATE_REGION,
                 "Content-type": "application/json",
-                "X-ClientTraceId": str(uuid.uuid4()),
+                "X-ClientTraceId": uuid.uuid4().hex,
             }
-            request = requests.post(url, headers=headers, json=[dict(text=description)])
+            _LIMITER.acquire()
+            request = _SESSION.post(
+                url, headers=headers, json=[dict(text=d) for d in chunk], timeout=slackbot_settings.HTTP_TIMEOUT
+            )
             response = request.json()
-            translate_description = response[0]["translations"][0]["text"]
-        except Exception:
-            translate_description = description
-        finally:
-            return [
-                dict(title="English", value=description, short=True),
-                dict(title="Japanese", value=translate_description, short=True),
-            ]
+            translations.extend(item["translations"][0]["text"] for item in response)
+        return translations
+
+    @staticmethod
+    def split_by_length(descriptions: list[str], max_length: int) -> list[list[str]]:
+        chunks = []
+        length = 0
+        for description in descriptions:
+            if not chunks or length + len(description) > max_length:
+                chunks.append([])
+                length = 0
+            chunks[-1].append(description)
+            length += len(description)
+        return chunks
 
 
 class ArXiv(Publisher):
     def __init__(self, genre: str) -> None:
-        self.rss = feedparser.parse(f"https://rss.arxiv.org/rss/{genre}")
+        self.url = f"https://rss.arxiv.org/rss/{genre}"
 
-    def get_publish_date(self, article: FeedParserDict) -> datetime:
+    def parse_feed(self, content: bytes, headers: Mapping[str, str]) -> FeedParserDict:
+        # The arXiv feed is plain RSS 2.0, so read the few fields used here with ElementTree,
+        # which is much faster than feedparser, and leave anything unexpected to feedparser
+        try:
+            channel = ElementTree.fromstring(content).find("channel")
+            updated = parsedate_to_datetime(channel.findtext("lastBuildDate"))
+        except (ElementTree.ParseError, AttributeError, TypeError, ValueError):
+            return super().parse_feed(content, headers)
+
+        entries = [
+            FeedParserDict(
+                title=item.findtext("title", "").strip(),
+                link=item.findtext("link", "").strip(),
+                description=item.findtext("description", "").strip(),
+                author=item.findtext("dc:creator", "", _RSS_NAMESPACES).strip(),
+            )
+            for item in channel.findall("item")
+        ]
+        return FeedParserDict(feed=FeedParserDict(updated_parsed=updated.utctimetuple()), entries=entries)
+
+    @cached_property
+    def feed_date(self) -> datetime:
+        # Every entry in the arXiv feed shares the date the feed was updated
         return datetime(*self.rss.feed.updated_parsed[:6], tzinfo=timezone.utc).date()
 
+    def get_publish_date(self, article: FeedParserDict) -> datetime:
+        return self.feed_date
+
+    def get_articles(self, patterns: list[re.Pattern]) -> dict[str, str]:
+        # A stale feed has no entry from today, so skip it without looking at the entries
+        if self.rss.entries and self.feed_date < datetime.now(timezone.utc).date():
+            return iter(())
+        return super().get_articles(patterns)
+
     @staticmethod
     def parse_title(title: str) -> str:
-        return re.sub(r" .(arXiv:.*)", "", title)
+        return _ARXIV_TITLE_RE.sub("", title)
+
+    @staticmethod
+    def parse_description(article: FeedParserDict) -> str:
+        abstract = article.description.partition("Abstract:")[2].partition("</p>")[0]
+        return _WHITESPACE_RE.sub(" ", abstract).strip()
 
-    def format_article(self, article: FeedParserDict, color: str) -> dict[str, str]:
-        title = self.parse_title(article.title)
+    def format_article(
+        self, article: FeedParserDict, title: str, color: str, fields: list[dict]
+    ) -> dict[str, str]:
         link = article.link.replace("http:", "https:")
-        description = " ".join(
-            article.description.split("Abstract:")[1].replace("\n", "").split("</p>")[0].split(" ")
-        )
-        authors = ", ".join(
-            [re.sub(r"<a href=.*\">", "", author).replace("</a>", "") for author in article.author.split(",")]
-        )
+        authors = _AUTHOR_LINK_RE.sub("", article.author).replace(",", ", ")
 
         return dict(
             title=title,
             title_link=link,
             author=authors,
-            fields=self.translate(description),
+            fields=fields,
             color=color,
         )
 
 
 class MDPI(Publisher):
     def __init__(self, genre: str) -> None:
-        self.rss = feedparser.parse(f"https://www.mdpi.com/rss/journal/{genre}")
+        self.url = f"https://www.mdpi.com/rss/journal/{genre}"
 
     def get_publish_date(self, article: FeedParserDict) -> datetime:
         return datetime(*article.published_parsed[:6], tzinfo=timezone.utc).date() + timedelta(days=1)
 
     @staticmethod
     def parse_title(title: str) -> str:
-        return re.sub(r".*[0-9]: ", "", title)
+        return _MDPI_TITLE_RE.sub("", title)
+
+    @staticmethod
+    def parse_description(article: FeedParserDict) -> str:
+        return _WHITESPACE_RE.sub(" ", article.summary.replace("'", "")).strip()
 
-    def format_article(self, article: FeedParserDict, color: str) -> dict[str, str]:
-        title = self.parse_title(article.title)
+    def format_article(
+        self, article: FeedParserDict, title: str, color: str, fields: list[dict]
+    ) -> dict[str, str]:
         link = article.link
-        description = " ".join(article.summary.replace("'", "").split(" "))
         authors = ", ".join([author["name"] for author in article.authors])
         return dict(
             title=title,
             title_link=link,
             author=authors,
-            fields=self.translate(description),
+            fields=fields,
             color=color,
         )
@@ -1,42 +1,87 @@
 # coding: UTF-8
 import re
-from importlib import import_module
+from concurrent.futures import ThreadPoolExecutor
+from itertools import chain
 
-from omegaconf import OmegaConf
+from omegaconf import DictConfig, OmegaConf
 from slack_sdk import WebClient
 
+import publisher
 import slackbot_settings
 
+# Characters that make a keyword a regular expression rather than a plain string
+_REGEX_SYNTAX_RE = re.compile(r"[][\\.^$*+?{}()|]")
+
 
 def get_articles(patterns: list[re.Pattern]) -> list[dict[str, str]]:
+    targets = []
+    for publish, genres in slackbot_settings.PUBLISH.items():
+        target_class = getattr(publisher, publish)
+        targets.extend(target_class(genre=g) for g in genres)
+
+    # Download all feeds at once so the wait is the slowest feed rather than the sum of them
+    with ThreadPoolExecutor(max_workers=max(len(targets), 1)) as executor:
+        for future in [executor.submit(target.fetch) for target in targets]:
+            future.result()
+
     articles = []
-    for publish, genre in slackbot_settings.PUBLISH.items():
-        genre = [genre] if isinstance(genre, str) else genre
-        for g in genre:
-            target = getattr(import_module("publisher"), publish)(genre=g)
-            articles.extend([i for i in list(target.get_articles(patterns)) if i is not None])
+    for target in targets:
+        articles.extend(target.get_articles(patterns))
     return articles
 
 
+def create_patterns(keywords: DictConfig) -> list[re.Pattern]:
+    words = list(chain.from_iterable(keywords[key] for key in keywords))
+    # Matching is case-insensitive, so keep one spelling of each plain keyword; regexes change meaning with case
+    plains = list({word.lower(): word for word in words if not _REGEX_SYNTAX_RE.search(word)}.values())
+    regexes = list(dict.fromkeys(word for word in words if _REGEX_SYNTAX_RE.search(word)))
+
+    patterns = []
+    if plains:
+        # Plain keywords share one prefix tree, so each title position is checked against it only once
+        patterns.append(re.compile(trie_pattern(plains), re.IGNORECASE))
+    if regexes:
+        patterns.append(re.compile("|".join(f"(?:{word})" for word in regexes), re.IGNORECASE))
+    return patterns
+
+
+def trie_pattern(words: list[str]) -> str:
+    trie = {}
+    for word in words:
+        node = trie
+        for char in word.lower():
+            node = node.setdefault(char, {})
+        node[""] = {}
+
+    def build(node: dict) -> str:
+        # Titles only need to contain a keyword, so a keyword ending here makes longer ones redundant
+        if "" in node:
+            return ""
+        branches = [re.escape(char) + build(child) for char, child in node.items()]
+        return branches[0] if len(branches) == 1 else f"(?:{'|'.join(branches)})"
+
+    return build(trie)
+
+
 def main(patterns: list[re.Pattern]) -> None:
     articles = get_articles(patterns)
     slacks = [WebClient(token) for token in slackbot_settings.SLACK_API_TOKEN]
+    options = dict(channel=slackbot_settings.CHANNEL, as_user=True, unfurl_links=False)
 
-    # Post message to slack channel
-    for article in articles:
-        text = f"*{article['title']}*\n" + f"{article['title_link']}\n" + f"{article['author']}\n"
-        attachment = dict(title="Abstract", fields=article["fields"], color=article["color"])
+    # Post message to slack channel, to every workspace at once but one article at a time
+    with ThreadPoolExecutor(max_workers=max(len(slacks), 1)) as executor:
+        for article in articles:
+            text = f"*{article['title']}*\n" + f"{article['title_link']}\n" + f"{article['author']}\n"
+            attachments = [dict(title="Abstract", fields=article["fields"], color=article["color"])]
 
-        for slack in slacks:
-            slack.chat_postMessage(
-                channel=slackbot_settings.CHANNEL,
-                text=text,
-                as_user=True,
-                unfurl_links=False,
-                attachments=[attachment],
-            )
+            futures = [
+                executor.submit(slack.chat_postMessage, text=text, attachments=attachments, **options)
+                for slack in slacks
+            ]
+            for future in futures:
+                future.result()
 
 
 if __name__ == "__main__":
     keywords = OmegaConf.load("keyword.yml")
-    main([re.compile(p, re.IGNORECASE) for p in sum([keywords[key] for key in keywords], [])])
+    main(create_patterns(keywords))
@@ -7,7 +7,8 @@ from dotenv import load_dotenv
 load_dotenv(".env")
 
 # API token
-SLACK_API_TOKEN = [os.environ.get(key) for key in os.environ.keys() if "SLACK_API_TOKEN" in key]
+# One token per workspace, as SLACK_API_TOKEN with an optional suffix, ordered by the suffix
+SLACK_API_TOKEN = [value for key, value in sorted(os.environ.items()) if key.startswith("SLACK_API_TOKEN")]
 DEEPL_API_TOKEN = os.environ.get("DEEPL_API_TOKEN")
 MS_TRANSLATE_KEY = os.environ.get("MS_TRANSLATE_KEY")
 MS_TRANSLATE_REGION = os.environ.get("MS_TRANSLATE_REGION")
@@ -17,6 +18,25 @@ CHANNEL = "paper"
 
 # RSS publisher
 PUBLISH = dict(ArXiv="cs.CV", MDPI="remotesensing")
+# A single genre may be given as a string
+PUBLISH = {publish: [genre] if isinstance(genre, str) else genre for publish, genre in PUBLISH.items()}
+
+# Timeout in seconds for outbound HTTP requests (connect, read)
+HTTP_TIMEOUT = (5, 20)
+
+# Number of translation batches sent concurrently, and descriptions per batch
+MAX_WORKERS = 8
+TRANSLATE_BATCH_SIZE = 50
+
+# Maximum translator requests per second shared by all workers (e.g. a 15 per minute quota is 15 / 60)
+TRANSLATE_RATE_LIMIT = 5
+
+# Consecutive failures before a translator is skipped, and seconds until it is tried again
+BREAKER_FAIL_MAX = 5
+BREAKER_RESET_TIMEOUT = 60
+
+# SQLite file where translations are cached between runs
+TRANSLATION_CACHE = ".cache/translations.sqlite3"
 
 # Slack color list
 COLOR = ["#d7003a", "f6ad49", "ffdb4f", "#00a381", "#89c3eb", "#bbc8e6", "#a59aca"]